@@ -19,11 +19,13 @@ from datetime import datetime, timezone, timedelta
 from pathlib import Path
 from urllib.parse import urlparse, quote, unquote, urlunparse
 
+import numpy as np
+
 from fastapi import FastAPI, Request, Query, BackgroundTasks
 from fastapi.responses import JSONResponse
 
 from dotenv import load_dotenv, dotenv_values
-from inference import predict, reload_model
+from inference import predict, predict_batch, reload_model
 import retrain
 from pymongo import MongoClient
 import motor.motor_asyncio
@@ -31,6 +33,8 @@ import motor.motor_asyncio
 from schemas import (
     PredictRequest,
     PredictResponse,
+    PredictBatchRequest,
+    PredictBatchResponse,
     HealthResponse,
     HealthChecks,
     ModelCheck,
@@ -119,19 +123,58 @@ def _get_mongo_db_name() -> str:
     return (os.getenv('MONGO_DB_NAME') or '').strip()
 
 
+def _get_mongo_compressors() -> str:
+    # Wire-protocol compression shrinks the repetitive BSON the report pulls
+    # (IPs, methods, country names). zstd is preferred when the zstandard
+    # package and server support are present; zlib is the stdlib fallback.
+    # pymongo silently skips compressors that aren't available.
+    return (os.getenv('MONGO_COMPRESSORS') or 'zstd,zlib').strip()
+
+
+# Sync pymongo client/collection cache — MongoClient keeps its own connection
+# pool, so constructing one per call paid TCP/TLS/auth setup every time, and
+# the candidate-DB probe cost an extra round-trip per candidate. Resolve once
+# and refresh after a short TTL so a fresh/empty DB at boot can recover.
+_sync_client: MongoClient | None = None
+_sync_coll = None
+_sync_coll_err: str | None = None
+_sync_resolved_at: float = 0.0
+_sync_lock = threading.Lock()
+
+_SYNC_RESOLVE_TTL_S = float(os.getenv('AI_MONGO_RESOLVE_TTL_S', '300'))
+
+
 # Sync pymongo helper — used by retrain.py (via import) and debug endpoint
 def _get_packets_collection():
-    mongo_url = _get_mongo_url()
-    if not mongo_url:
-        return None, 'MONGO_URL not set for ai-engine'
+    global _sync_client, _sync_coll, _sync_coll_err, _sync_resolved_at
 
-    client = MongoClient(
-        mongo_url,
-        serverSelectionTimeoutMS=5000,
-        connectTimeoutMS=5000,
-        socketTimeoutMS=5000
-    )
+    now_mono = time.monotonic()
+    with _sync_lock:
+        if _sync_resolved_at and (now_mono - _sync_resolved_at) < _SYNC_RESOLVE_TTL_S:
+            return _sync_coll, _sync_coll_err
 
+        mongo_url = _get_mongo_url()
+        if not mongo_url:
+            _sync_coll, _sync_coll_err = None, 'MONGO_URL not set for ai-engine'
+            _sync_resolved_at = now_mono
+            return _sync_coll, _sync_coll_err
+
+        if _sync_client is None:
+            _sync_client = MongoClient(
+                mongo_url,
+                serverSelectionTimeoutMS=5000,
+                connectTimeoutMS=5000,
+                socketTimeoutMS=5000,
+                maxPoolSize=50,
+                compressors=_get_mongo_compressors(),
+            )
+
+        _sync_coll, _sync_coll_err = _resolve_packets_collection(_sync_client)
+        _sync_resolved_at = now_mono
+        return _sync_coll, _sync_coll_err
+
+
+def _resolve_packets_collection(client: MongoClient):
     # Prefer default DB from connection string, else explicit env var, else fallback.
     db = None
     try:
@@ -186,6 +229,7 @@ def _get_motor_client() -> motor.motor_asyncio.AsyncIOMotorClient | None:
         serverSelectionTimeoutMS=5000,
         connectTimeoutMS=5000,
         socketTimeoutMS=5000,
+        compressors=_get_mongo_compressors(),
     )
     return _motor_client
 
@@ -232,12 +276,36 @@ async def _get_async_packets_collection():
 # Lifespan (startup / shutdown)
 # ──────────────────────────────────────────────
 
+async def _ensure_report_indexes():
+    """Best-effort creation of the compound index backing /report/threat-intel.
+
+    (owner_user_id, is_anomaly, timestamp) matches the $match + window shape
+    of every report pipeline, so Mongo can walk the index instead of a
+    collection scan. Failures (no Mongo configured, unreachable, no perms)
+    are logged and ignored — the report works without the index, just slower.
+    """
+    try:
+        coll, err = await _get_async_packets_collection()
+        if coll is None:
+            logger.info(f"Skipping report index creation: {err}")
+            return
+        await coll.create_index(
+            [('owner_user_id', 1), ('is_anomaly', 1), ('timestamp', -1)],
+            background=True,
+            name='owner_anomaly_ts',
+        )
+        logger.info("Report index owner_anomaly_ts ensured.")
+    except Exception as e:
+        logger.warning(f"Could not ensure report index: {e}")
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # Startup: preload model so the first /predict doesn't pay load cost.
     import inference
     inference.reload_model()
     logger.info("Model preloaded at startup.")
+    await _ensure_report_indexes()
     yield
     # Shutdown: close Motor client cleanly.
     global _motor_client
@@ -289,6 +357,7 @@ async def root():
         'endpoints': {
             'health': '/health',
             'predict': '/predict',
+            'predict_batch': '/predict_batch',
             'docs': '/docs',
         },
     }
@@ -337,8 +406,13 @@ async def health():
     return JSONResponse(content=payload.model_dump(), status_code=status_code)
 
 
+# The predict handlers are deliberately sync (plain `def`): request parsing is
+# already compiled pydantic-core, and the remaining cost is the CPU-bound
+# sklearn/SHAP call. As sync routes FastAPI runs them on the threadpool, so
+# model scoring no longer stalls the event loop for every other request.
+
 @app.post('/predict', response_model=PredictResponse)
-async def handle_predict(data: PredictRequest):
+def handle_predict(data: PredictRequest):
     try:
         # Convert Pydantic model to dict for the existing predict() function
         result = predict(data.model_dump())
@@ -347,6 +421,15 @@ async def handle_predict(data: PredictRequest):
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
 
+@app.post('/predict_batch', response_model=PredictBatchResponse)
+def handle_predict_batch(data: PredictBatchRequest):
+    try:
+        results = predict_batch([p.model_dump() for p in data.packets])
+        return PredictBatchResponse(count=len(results), results=results)
+    except Exception as e:
+        return JSONResponse(content={"error": str(e)}, status_code=500)
+
+
 @app.post('/admin/reload-model', response_model=ReloadModelResponse)
 async def handle_reload_model():
     success, msg = reload_model()
@@ -435,41 +518,251 @@ async def debug_db():
 # Threat-intel helpers
 # ──────────────────────────────────────────────
 
-def _ip_to_country_name(ip: str) -> str:
-    # Must stay in sync with dashboard/src/utils/geoData.js ordering.
-    countries = [
-        'United States',
-        'Canada',
-        'Brazil',
-        'United Kingdom',
-        'Germany',
-        'Russia',
-        'China',
-        'Japan',
-        'Australia',
-        'South Africa',
-    ]
-
-    s = (ip or '').strip()
-    try:
-        first = int(s.split('.')[0])
-        if first < 0:
-            return countries[0]
-        return countries[abs(first) % len(countries)]
-    except Exception:
-        return countries[0]
+# Must stay in sync with dashboard/src/utils/geoData.js ordering.
+_COUNTRIES = (
+    'United States',
+    'Canada',
+    'Brazil',
+    'United Kingdom',
+    'Germany',
+    'Russia',
+    'China',
+    'Japan',
+    'Australia',
+    'South Africa',
+)
 
+_MUTATING_METHODS = frozenset({'POST', 'PUT', 'PATCH', 'DELETE'})
 
-def _classify_attack_vector(method: str, bytes_count: int) -> str:
-    # Simple heuristic classification based on stored telemetry.
-    m = (method or '').strip().upper()
-    b = int(bytes_count or 0)
 
-    if b >= 7000:
-        return 'Volumetric'
-    if m in {'POST', 'PUT', 'PATCH', 'DELETE'}:
-        return 'Application'
-    return 'Protocol'
+# Pipeline fragments for /report/threat-intel. These are pure constants —
+# hoisted to module scope so the handler does not rebuild dozens of nested
+# dicts/lists per request.
+
+# Robust timestamp parsing: supports BSON Date and ISO-like strings.
+_ADD_TS = {
+    '$addFields': {
+        'ts': {
+            '$convert': {
+                'input': '$timestamp',
+                'to': 'date',
+                'onError': None,
+                'onNull': None,
+            }
+        }
+    }
+}
+
+# Country derivation (matches the legacy deterministic mapping when explicit
+# country is missing).
+_COUNTRY_EXPR = {
+    '$let': {
+        'vars': {
+            'explicit': {
+                '$trim': {
+                    'input': {
+                        '$ifNull': ['$source_country', '']
+                    }
+                }
+            },
+            'ipStr': {
+                '$ifNull': ['$source_ip', '']
+            },
+        },
+        'in': {
+            '$cond': [
+                {'$gt': [{'$strLenCP': '$$explicit'}, 0]},
+                '$$explicit',
+                {
+                    '$let': {
+                        'vars': {
+                            'firstOctetStr': {
+                                '$arrayElemAt': [
+                                    {'$split': ['$$ipStr', '.']},
+                                    0,
+                                ]
+                            }
+                        },
+                        'in': {
+                            '$let': {
+                                'vars': {
+                                    'firstInt': {
+                                        '$convert': {
+                                            'input': '$$firstOctetStr',
+                                            'to': 'int',
+                                            'onError': 0,
+                                            'onNull': 0,
+                                        }
+                                    }
+                                },
+                                'in': {
+                                    '$arrayElemAt': [
+                                        list(_COUNTRIES),
+                                        {
+                                            '$mod': [
+                                                {'$abs': '$$firstInt'},
+                                                len(_COUNTRIES),
+                                            ]
+                                        },
+                                    ]
+                                },
+                            }
+                        },
+                    }
+                },
+            ]
+        },
+    }
+}
+
+# Attack vector derivation (matches the legacy heuristic + respects explicit values).
+_VECTOR_EXPR = {
+    '$let': {
+        'vars': {
+            'explicit': {
+                '$toLower': {
+                    '$trim': {
+                        'input': {
+                            '$ifNull': ['$attack_vector', '']
+                        }
+                    }
+                }
+            },
+            'm': {
+                '$toUpper': {
+                    '$ifNull': ['$method', '']
+                }
+            },
+            'b': {
+                '$convert': {
+                    'input': '$bytes',
+                    'to': 'int',
+                    'onError': 0,
+                    'onNull': 0,
+                }
+            },
+        },
+        'in': {
+            '$switch': {
+                'branches': [
+                    {
+                        'case': {
+                            '$regexMatch': {'input': '$$explicit', 'regex': r'^vol'}
+                        },
+                        'then': 'Volumetric',
+                    },
+                    {
+                        'case': {
+                            '$regexMatch': {'input': '$$explicit', 'regex': r'^prot'}
+                        },
+                        'then': 'Protocol',
+                    },
+                    {
+                        'case': {
+                            '$regexMatch': {'input': '$$explicit', 'regex': r'^app'}
+                        },
+                        'then': 'Application',
+                    },
+                ],
+                'default': {
+                    '$cond': [
+                        {'$gte': ['$$b', 7000]},
+                        'Volumetric',
+                        {
+                            '$cond': [
+                                {'$in': ['$$m', sorted(_MUTATING_METHODS)]},
+                                'Application',
+                                'Protocol',
+                            ]
+                        },
+                    ]
+                },
+            }
+        },
+    }
+}
+
+
+def _window_match(since: datetime, now: datetime) -> dict:
+    """$match stage bounding the converted ts field to the report window."""
+    return {
+        '$match': {
+            'ts': {
+                '$gte': since,
+                '$lt': now,
+            }
+        }
+    }
+
+
+def _prefilter_match(base_match: dict, since: datetime, now: datetime) -> dict:
+    """Index-friendly head $match for the report pipelines.
+
+    The window filter on the computed ts field can never use an index, so
+    BSON-Date timestamps are additionally bounded here on the raw field —
+    letting Mongo walk the (owner_user_id, is_anomaly, timestamp) index.
+    String timestamps (the other supported form) pass through and are
+    filtered exactly by _window_match after the $convert.
+    """
+    return {
+        '$match': {
+            **base_match,
+            '$or': [
+                {'timestamp': {'$gte': since, '$lt': now}},
+                {'timestamp': {'$type': 'string'}},
+            ],
+        }
+    }
+
+
+# Short-TTL cache for /report/threat-intel. Dashboards poll the report every
+# few seconds, and every poll recomputed the same Mongo window. Entries are
+# keyed by (sinceHours, ownerUserId); the TTL is deliberately short so the
+# report stays near-real-time. AI_REPORT_CACHE_TTL_S=0 disables caching.
+_REPORT_CACHE_TTL_S = float(os.getenv('AI_REPORT_CACHE_TTL_S', '10'))
+_report_cache: dict[tuple, tuple[float, ThreatIntelResponse]] = {}
+_report_cache_lock = threading.Lock()
+
+
+def _report_cache_get(key: tuple) -> ThreatIntelResponse | None:
+    if _REPORT_CACHE_TTL_S <= 0:
+        return None
+    with _report_cache_lock:
+        hit = _report_cache.get(key)
+        if hit and (time.monotonic() - hit[0]) < _REPORT_CACHE_TTL_S:
+            return hit[1]
+    return None
+
+
+def _report_cache_put(key: tuple, response: ThreatIntelResponse) -> None:
+    if _REPORT_CACHE_TTL_S <= 0:
+        return
+    with _report_cache_lock:
+        # Keyspace is tiny (a handful of window/owner combinations); a full
+        # clear on overflow is simpler than LRU bookkeeping.
+        if len(_report_cache) >= 64:
+            _report_cache.clear()
+        _report_cache[key] = (time.monotonic(), response)
+
+
+def _empty_threat_intel(since_iso: str, now_iso: str, since_hours: int) -> ThreatIntelResponse:
+    """Zero-count report skeleton for windows containing no anomalies."""
+    return ThreatIntelResponse(
+        window=WindowInfo(since=since_iso, to=now_iso, sinceHours=since_hours),
+        totalThreats=0,
+        topHostileIps=[],
+        attackVectorDistribution=[
+            AttackVectorEntry(name='Volumetric', value=0),
+            AttackVectorEntry(name='Protocol', value=0),
+            AttackVectorEntry(name='Application', value=0),
+        ],
+        geoTopCountries=[],
+        aiConfidenceDistribution=[
+            AiConfidenceBucket(bucket='Obvious', count=0),
+            AiConfidenceBucket(bucket='Subtle', count=0),
+            AiConfidenceBucket(bucket='Other', count=0),
+        ],
+    )
 
 
 async def _run_aggregation(coll, pipeline: list, allow_disk_use: bool = False) -> list:
@@ -478,11 +771,61 @@ async def _run_aggregation(coll, pipeline: list, allow_disk_use: bool = False) -
     return await cursor.to_list(length=None)
 
 
+async def _collect_scores(coll, pipeline: list, batch_size: int = 5000) -> np.ndarray:
+    """Stream anomaly scores out of an aggregation without materializing docs.
+
+    Consumes the cursor in large batches and keeps only the finite float
+    score per document, instead of buffering a list of BSON dicts and
+    re-walking it afterwards.
+    """
+    out: list[float] = []
+    cursor = coll.aggregate(pipeline, allowDiskUse=True, batchSize=batch_size)
+    async for r in cursor:
+        s = r.get('anomaly_score')
+        try:
+            if s is None:
+                continue
+            sf = float(s)
+            if math.isfinite(sf):
+                out.append(sf)
+        except Exception:
+            continue
+    return np.asarray(out, dtype=np.float64)
+
+
+def _partition_quantiles(arr: np.ndarray, qs: tuple[float, ...]) -> list[float]:
+    """Linear-interpolated quantiles via np.partition (O(n) introselect).
+
+    Matches the default 'linear' interpolation of numpy/pandas quantiles
+    without fully sorting the array.
+    """
+    n = arr.size
+    if n == 1:
+        return [float(arr[0])] * len(qs)
+    kth: set[int] = set()
+    positions = []
+    for q in qs:
+        pos = (n - 1) * q
+        lo = int(math.floor(pos))
+        hi = int(math.ceil(pos))
+        kth.update((lo, hi))
+        positions.append((pos, lo, hi))
+    part = np.partition(arr, sorted(kth))
+    out = []
+    for pos, lo, hi in positions:
+        if lo == hi:
+            out.append(float(part[lo]))
+        else:
+            w = pos - lo
+            out.append(float(part[lo] * (1.0 - w) + part[hi] * w))
+    return out
+
+
 # ──────────────────────────────────────────────
 # /report/threat-intel  (async with Motor)
 # ──────────────────────────────────────────────
 
-@app.get('/report/threat-intel')
+@app.get('/report/threat-intel', response_model=ThreatIntelResponse)
 async def report_threat_intel(
     sinceHours: str = Query('24'),
     ownerUserId: str = Query(''),
@@ -504,10 +847,18 @@ async def report_threat_intel(
         except Exception:
             since_hours = 24
 
+        cache_key = (since_hours, owner_user_id)
+        cached = _report_cache_get(cache_key)
+        if cached is not None:
+            return cached
+
         # Use UTC datetimes for windowing; convert to naive for Mongo queries
         # (pymongo default is tz_aware=False).
         now = datetime.now(timezone.utc).replace(tzinfo=None)
         since = now - timedelta(hours=since_hours)
+        # Format once; both the empty and populated branches need these.
+        since_iso = since.isoformat() + 'Z'
+        now_iso = now.isoformat() + 'Z'
 
         # Base filter: only anomalies.
         base_match = {
@@ -516,213 +867,50 @@ async def report_threat_intel(
         if owner_user_id:
             base_match['owner_user_id'] = owner_user_id
 
-        # Robust timestamp parsing: supports BSON Date and ISO-like strings.
-        add_ts = {
-            '$addFields': {
-                'ts': {
-                    '$convert': {
-                        'input': '$timestamp',
-                        'to': 'date',
-                        'onError': None,
-                        'onNull': None,
-                    }
-                }
-            }
-        }
-        window_match = {
-            '$match': {
-                'ts': {
-                    '$gte': since,
-                    '$lt': now,
-                }
-            }
-        }
+        window_match = _window_match(since, now)
 
-        # Country derivation (matches the legacy deterministic mapping when explicit country is missing)
-        countries = [
-            'United States',
-            'Canada',
-            'Brazil',
-            'United Kingdom',
-            'Germany',
-            'Russia',
-            'China',
-            'Japan',
-            'Australia',
-            'South Africa',
-        ]
+        # One $facet pipeline computes the count, top-IP, vector and geo
+        # summaries in a single round trip, so the $match + timestamp
+        # conversion prefix runs once server-side instead of four times.
+        # Scores stay a separate streamed aggregation: $facet output is a
+        # single 16MB-capped document, too tight a ceiling for a raw
+        # per-document score list.
+        head_match = _prefilter_match(base_match, since, now)
 
-        country_expr = {
-            '$let': {
-                'vars': {
-                    'explicit': {
-                        '$trim': {
-                            'input': {
-                                '$ifNull': ['$source_country', '']
-                            }
-                        }
-                    },
-                    'ipStr': {
-                        '$ifNull': ['$source_ip', '']
-                    },
-                },
-                'in': {
-                    '$cond': [
-                        {'$gt': [{'$strLenCP': '$$explicit'}, 0]},
-                        '$$explicit',
+        summary_pipeline = [
+            head_match,
+            _ADD_TS,
+            window_match,
+            {
+                '$facet': {
+                    'topIps': [
                         {
-                            '$let': {
-                                'vars': {
-                                    'firstOctetStr': {
-                                        '$arrayElemAt': [
-                                            {'$split': ['$$ipStr', '.']},
-                                            0,
-                                        ]
-                                    }
-                                },
-                                'in': {
-                                    '$let': {
-                                        'vars': {
-                                            'firstInt': {
-                                                '$convert': {
-                                                    'input': '$$firstOctetStr',
-                                                    'to': 'int',
-                                                    'onError': 0,
-                                                    'onNull': 0,
-                                                }
-                                            }
-                                        },
-                                        'in': {
-                                            '$arrayElemAt': [
-                                                countries,
-                                                {
-                                                    '$mod': [
-                                                        {'$abs': '$$firstInt'},
-                                                        len(countries),
-                                                    ]
-                                                },
-                                            ]
-                                        },
-                                    }
-                                },
-                            }
-                        },
-                    ]
-                },
-            }
-        }
-
-        # Attack vector derivation (matches the legacy heuristic + respects explicit values)
-        vector_expr = {
-            '$let': {
-                'vars': {
-                    'explicit': {
-                        '$toLower': {
-                            '$trim': {
-                                'input': {
-                                    '$ifNull': ['$attack_vector', '']
-                                }
+                            '$group': {
+                                '_id': {'$ifNull': ['$source_ip', '']},
+                                'count': {'$sum': 1},
+                                'lastSeen': {'$max': '$ts'},
                             }
-                        }
-                    },
-                    'm': {
-                        '$toUpper': {
-                            '$ifNull': ['$method', '']
-                        }
-                    },
-                    'b': {
-                        '$convert': {
-                            'input': '$bytes',
-                            'to': 'int',
-                            'onError': 0,
-                            'onNull': 0,
-                        }
-                    },
-                },
-                'in': {
-                    '$switch': {
-                        'branches': [
-                            {
-                                'case': {
-                                    '$regexMatch': {'input': '$$explicit', 'regex': r'^vol'}
-                                },
-                                'then': 'Volumetric',
-                            },
-                            {
-                                'case': {
-                                    '$regexMatch': {'input': '$$explicit', 'regex': r'^prot'}
-                                },
-                                'then': 'Protocol',
-                            },
-                            {
-                                'case': {
-                                    '$regexMatch': {'input': '$$explicit', 'regex': r'^app'}
-                                },
-                                'then': 'Application',
-                            },
-                        ],
-                        'default': {
-                            '$cond': [
-                                {'$gte': ['$$b', 7000]},
-                                'Volumetric',
-                                {
-                                    '$cond': [
-                                        {'$in': ['$$m', ['POST', 'PUT', 'PATCH', 'DELETE']]},
-                                        'Application',
-                                        'Protocol',
-                                    ]
-                                },
-                            ]
                         },
-                    }
-                },
-            }
-        }
-
-        # Build all 5 aggregation pipelines
-        total_pipeline = [
-            {'$match': base_match},
-            add_ts,
-            window_match,
-            {'$count': 'count'},
-        ]
-
-        ip_pipeline = [
-            {'$match': base_match},
-            add_ts,
-            window_match,
-            {
-                '$group': {
-                    '_id': {'$ifNull': ['$source_ip', '']},
-                    'count': {'$sum': 1},
-                    'lastSeen': {'$max': '$ts'},
+                        {'$sort': {'count': -1, 'lastSeen': -1}},
+                        {'$limit': 5},
+                    ],
+                    'vectors': [
+                        {'$addFields': {'vector': _VECTOR_EXPR}},
+                        {'$group': {'_id': '$vector', 'value': {'$sum': 1}}},
+                    ],
+                    'geo': [
+                        {'$addFields': {'country': _COUNTRY_EXPR}},
+                        {'$group': {'_id': '$country', 'count': {'$sum': 1}}},
+                        {'$sort': {'count': -1}},
+                        {'$limit': 5},
+                    ],
                 }
             },
-            {'$sort': {'count': -1, 'lastSeen': -1}},
-            {'$limit': 5},
-        ]
-
-        vector_pipeline = [
-            {'$match': base_match},
-            add_ts,
-            window_match,
-            {'$addFields': {'vector': vector_expr}},
-            {'$group': {'_id': '$vector', 'value': {'$sum': 1}}},
-        ]
-
-        country_pipeline = [
-            {'$match': base_match},
-            add_ts,
-            window_match,
-            {'$addFields': {'country': country_expr}},
-            {'$group': {'_id': '$country', 'count': {'$sum': 1}}},
-            {'$sort': {'count': -1}},
-            {'$limit': 5},
         ]
 
         score_pipeline = [
-            {'$match': base_match},
-            add_ts,
+            head_match,
+            _ADD_TS,
             window_match,
             {
                 '$project': {
@@ -732,38 +920,25 @@ async def report_threat_intel(
             },
         ]
 
-        # Run ALL 5 aggregations concurrently via asyncio.gather
-        total_rows, ip_rows, vector_rows, country_rows, score_rows = await asyncio.gather(
-            _run_aggregation(coll, total_pipeline),
-            _run_aggregation(coll, ip_pipeline),
-            _run_aggregation(coll, vector_pipeline),
-            _run_aggregation(coll, country_pipeline),
-            _run_aggregation(coll, score_pipeline, allow_disk_use=True),
+        # The fused summary and the score stream still run concurrently.
+        summary_rows, scores = await asyncio.gather(
+            _run_aggregation(coll, summary_pipeline, allow_disk_use=True),
+            _collect_scores(coll, score_pipeline),
         )
 
-        total = int((total_rows[0]['count'] if total_rows else 0) or 0)
+        summary = summary_rows[0] if summary_rows else {}
+        ip_rows = summary.get('topIps') or []
+        vector_rows = summary.get('vectors') or []
+        country_rows = summary.get('geo') or []
+
+        # Every matched document gets exactly one vector, so the vector
+        # counts already sum to the window total — no dedicated $count facet.
+        total = sum(int(r.get('value') or 0) for r in vector_rows)
 
         if total <= 0:
-            return ThreatIntelResponse(
-                window=WindowInfo(
-                    since=since.isoformat() + 'Z',
-                    to=now.isoformat() + 'Z',
-                    sinceHours=since_hours,
-                ),
-                totalThreats=0,
-                topHostileIps=[],
-                attackVectorDistribution=[
-                    AttackVectorEntry(name='Volumetric', value=0),
-                    AttackVectorEntry(name='Protocol', value=0),
-                    AttackVectorEntry(name='Application', value=0),
-                ],
-                geoTopCountries=[],
-                aiConfidenceDistribution=[
-                    AiConfidenceBucket(bucket='Obvious', count=0),
-                    AiConfidenceBucket(bucket='Subtle', count=0),
-                    AiConfidenceBucket(bucket='Other', count=0),
-                ],
-            )
+            empty = _empty_threat_intel(since_iso, now_iso, since_hours)
+            _report_cache_put(cache_key, empty)
+            return empty
 
         # Top hostile IPs
         top_hostile = []
@@ -799,53 +974,31 @@ async def report_threat_intel(
             geo_top.append(GeoCountry(name=name, count=c, pct=int(pct)))
 
         # AI confidence distribution (quantiles over full window)
-        scores = []
-        for r in score_rows:
-            s = r.get('anomaly_score')
-            try:
-                if s is None:
-                    continue
-                sf = float(s)
-                if math.isfinite(sf):
-                    scores.append(sf)
-            except Exception:
-                continue
-
         obvious = 0
         subtle = 0
         other = int(total)
         thresholds = AiConfidenceThresholds()
 
-        if scores:
-            s_sorted = sorted(scores)
-            if len(s_sorted) >= 2 and (s_sorted[-1] - s_sorted[0]) >= 1e-9:
-                # Match pandas' default quantile interpolation ('linear').
-                def _quantile(sorted_values, q: float) -> float:
-                    n = len(sorted_values)
-                    if n == 1:
-                        return float(sorted_values[0])
-                    pos = (n - 1) * q
-                    lo = int(math.floor(pos))
-                    hi = int(math.ceil(pos))
-                    if lo == hi:
-                        return float(sorted_values[lo])
-                    w = pos - lo
-                    return float(sorted_values[lo] * (1.0 - w) + sorted_values[hi] * w)
-
-                q_obvious = _quantile(s_sorted, 0.20)
-                q_subtle = _quantile(s_sorted, 0.60)
+        if scores.size:
+            if scores.size >= 2 and float(scores.max() - scores.min()) >= 1e-9:
+                # O(n) selection instead of a full sort; same 'linear'
+                # interpolation as the old pandas-style helper.
+                q_obvious, q_subtle = _partition_quantiles(scores, (0.20, 0.60))
                 thresholds = AiConfidenceThresholds(obviousLe=q_obvious, subtleLe=q_subtle)
 
-                for s in scores:
-                    if s <= q_obvious:
-                        obvious += 1
-                    elif s <= q_subtle:
-                        subtle += 1
+                # Single bucket-assignment sweep (<= q_obvious -> 0,
+                # <= q_subtle -> 1, else 2) instead of two boolean-mask scans
+                # with their temporaries.
+                buckets = np.searchsorted((q_obvious, q_subtle), scores, side='left')
+                counts = np.bincount(buckets, minlength=3)
+                obvious = int(counts[0])
+                subtle = int(counts[1])
                 other = int(total - obvious - subtle)
             else:
                 # If all scores are identical (or nearly identical), value-based
                 # thresholds collapse. Fall back to rank-based buckets.
-                n = len(s_sorted)
+                s_sorted = np.sort(scores)
+                n = s_sorted.size
                 n_obvious = int(math.ceil(n * 0.20))
                 n_subtle = int(math.ceil(n * 0.40))
                 obvious = n_obvious
@@ -856,10 +1009,10 @@ async def report_threat_intel(
                     subtleLe=float(s_sorted[min(n_obvious + n_subtle - 1, n - 1)]),
                 )
 
-        return ThreatIntelResponse(
+        response = ThreatIntelResponse(
             window=WindowInfo(
-                since=since.isoformat() + 'Z',
-                to=now.isoformat() + 'Z',
+                since=since_iso,
+                to=now_iso,
                 sinceHours=since_hours,
             ),
             totalThreats=total,
@@ -873,6 +1026,8 @@ async def report_threat_intel(
                 AiConfidenceBucket(bucket='Other', count=other),
             ],
         )
+        _report_cache_put(cache_key, response)
+        return response
     except Exception as e:
         logger.error(f"report_threat_intel error: {e}")
         traceback.print_exc()
@@ -935,6 +1090,19 @@ if __name__ == '__main__':
         port = int(os.getenv('PORT', '5000'))
     except Exception:
         port = 5000
+
+    # Containers launch uvicorn via start.sh; this entrypoint is for local
+    # runs. Auto-reload forces a single process and serializes CPU-bound
+    # /predict calls, so it is opt-in via AI_DEV=1; otherwise honor the same
+    # UVICORN_WORKERS knob the container uses.
+    try:
+        workers = max(1, int(os.getenv('UVICORN_WORKERS', '1')))
+    except Exception:
+        workers = 1
+
     print(f"AI Service running on http://{host}:{port}")
 
-    uvicorn.run("app:app", host=host, port=port, reload=True)
\ No newline at end of file
+    if (os.getenv('AI_DEV') or '').strip() == '1':
+        uvicorn.run("app:app", host=host, port=port, reload=True)
+    else:
+        uvicorn.run("app:app", host=host, port=port, workers=workers)
\ No newline at end of file
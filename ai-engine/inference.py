@@ -1,6 +1,8 @@
 import os
 import math
+import functools
 import threading
+import numpy as np
 import pandas as pd
 import joblib
 import shap
@@ -9,6 +11,10 @@ from pathlib import Path
 
 logger = logging.getLogger(__name__)
 
+# Copy-on-write drops pandas' defensive block copies (and becomes the default
+# in pandas 3.0); nothing in this service relies on chained assignment.
+pd.set_option('mode.copy_on_write', True)
+
 BASE_DIR = Path(__file__).resolve().parent
 MODEL_PATH = Path(os.getenv("MODEL_PATH", str(BASE_DIR / "model" / "model.pkl")))
 
@@ -17,6 +23,14 @@ _model_error = None
 _explainer = None
 _model_lock = threading.Lock()
 
+# Per-model facts resolved once at load time so predict() doesn't repeat
+# isinstance/dict/column checks per call: (estimator, cols, needs_reindex,
+# scaler). Swapped as one tuple and always assigned before _model on load;
+# readers take one snapshot via _ensure_loaded_locked() rather than re-reading
+# this global, so a concurrently failing reload (which nulls _model first,
+# then _resolved) can never hand them a None tuple to unpack.
+_resolved: tuple | None = None
+
 SHAP_TOP_N = int(os.getenv("SHAP_TOP_N", "3"))
 SHAP_MIN_VALUE = float(os.getenv("SHAP_MIN_VALUE", "0.05"))
 
@@ -30,63 +44,191 @@ PROTOCOL_TO_INDEX = {
 COMMON_PORTS = {80, 443, 8080}
 ATTACK_PORTS = {23, 53, 123, 445, 3389, 1900, 4444}
 
-def _protocol_index(protocol: str) -> int:
+# 64 KB port-class bitmap (bit 0 = common, bit 1 = attack). Lets batch
+# feature building classify every port with one vectorized gather instead
+# of two isin() hash-set broadcasts.
+_PORT_CLASS = np.zeros(65536, dtype=np.uint8)
+_PORT_CLASS[list(COMMON_PORTS)] |= 1
+_PORT_CLASS[list(ATTACK_PORTS)] |= 2
+
+# Canonical engineered-feature order; must match _build_features and the
+# feature_columns stored in the model bundle.
+_FEATURE_COLS = (
+    'bytes_log',
+    'entropy',
+    'dst_port',
+    'proto_tcp',
+    'proto_udp',
+    'proto_icmp',
+    'proto_http',
+    'port_is_common',
+    'port_is_attack',
+    'port_is_weird',
+)
+
+# Lookup table keyed by the protocol strings as they actually arrive
+# (canonical upper plus lowercase variants), so the common case is a single
+# dict hit with no strip/upper string allocations.
+_PROTO_LUT = {
+    **PROTOCOL_TO_INDEX,
+    **{k.lower(): v for k, v in PROTOCOL_TO_INDEX.items()},
+    **{k.capitalize(): v for k, v in PROTOCOL_TO_INDEX.items()},
+}
+
+def _protocol_index(protocol) -> int:
+    # Upstream may send a precomputed integer index; accept it directly.
+    if isinstance(protocol, int):
+        return protocol if 0 <= protocol <= 3 else 0
+    idx = _PROTO_LUT.get(protocol)
+    if idx is not None:
+        return idx
     p = (protocol or '').strip().upper()
     return int(PROTOCOL_TO_INDEX.get(p, 0))
 
 def _build_features(raw_df: pd.DataFrame) -> pd.DataFrame:
-    df = raw_df.copy()
-
-    df['bytes_log'] = df['bytes'].astype(float).map(lambda x: math.log1p(max(0.0, x)))
-    df['entropy'] = pd.to_numeric(df['entropy'], errors='coerce').fillna(0.3).astype(float).clip(0.0, 1.0)
-    df['dst_port'] = pd.to_numeric(df['dst_port'], errors='coerce').fillna(80).astype(int)
-
-    df['proto_tcp'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['TCP']).astype(int)
-    df['proto_udp'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['UDP']).astype(int)
-    df['proto_icmp'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['ICMP']).astype(int)
-    df['proto_http'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['HTTP']).astype(int)
-
-    df['port_is_common'] = df['dst_port'].isin(COMMON_PORTS).astype(int)
-    df['port_is_attack'] = df['dst_port'].isin(ATTACK_PORTS).astype(int)
-    df['port_is_weird'] = (~df['dst_port'].isin(COMMON_PORTS)).astype(int)
-
-    cols = [
-        'bytes_log',
-        'entropy',
-        'dst_port',
-        'proto_tcp',
-        'proto_udp',
-        'proto_icmp',
-        'proto_http',
-        'port_is_common',
-        'port_is_attack',
-        'port_is_weird',
-    ]
-    return df[cols]
+    """Build the engineered feature matrix for a batch of raw packet rows.
+
+    Fully vectorized: each feature is one NumPy C-level pass over the input
+    columns (no per-row Python callbacks, no full-frame copy), written into
+    a single preallocated matrix in _FEATURE_COLS order.
+    """
+    b = pd.to_numeric(raw_df['bytes'], errors='coerce').fillna(0).to_numpy(np.float64)
+    entropy = pd.to_numeric(raw_df['entropy'], errors='coerce').fillna(0.3).to_numpy(np.float64)
+    ports = pd.to_numeric(raw_df['dst_port'], errors='coerce').fillna(80).to_numpy(np.int64)
+    proto = pd.to_numeric(raw_df['protocol_index'], errors='coerce').fillna(0).to_numpy(np.int64)
+
+    mat = np.empty((len(raw_df), len(_FEATURE_COLS)), dtype=np.float64)
+    mat[:, 0] = np.log1p(np.clip(b, 0.0, None))
+    mat[:, 1] = np.clip(entropy, 0.0, 1.0)
+    mat[:, 2] = ports
+    mat[:, 3] = proto == PROTOCOL_TO_INDEX['TCP']
+    mat[:, 4] = proto == PROTOCOL_TO_INDEX['UDP']
+    mat[:, 5] = proto == PROTOCOL_TO_INDEX['ICMP']
+    mat[:, 6] = proto == PROTOCOL_TO_INDEX['HTTP']
+
+    pc = _PORT_CLASS[np.clip(ports, 0, 65535)]
+    is_common = pc & 1
+    mat[:, 7] = is_common
+    mat[:, 8] = (pc & 2) >> 1
+    mat[:, 9] = 1 - is_common
+
+    return pd.DataFrame(mat, columns=list(_FEATURE_COLS), index=raw_df.index, copy=False)
+
+def _fill_feature_row(out, i: int, packet_bytes: int, protocol_index: int, entropy: float, dst_port: int) -> None:
+    """Write one packet's engineered features into row i of a preallocated matrix."""
+    out[i, 0] = math.log1p(max(0.0, float(packet_bytes)))
+    out[i, 1] = entropy
+    out[i, 2] = dst_port
+    out[i, 3] = 1.0 if protocol_index == PROTOCOL_TO_INDEX['TCP'] else 0.0
+    out[i, 4] = 1.0 if protocol_index == PROTOCOL_TO_INDEX['UDP'] else 0.0
+    out[i, 5] = 1.0 if protocol_index == PROTOCOL_TO_INDEX['ICMP'] else 0.0
+    out[i, 6] = 1.0 if protocol_index == PROTOCOL_TO_INDEX['HTTP'] else 0.0
+    is_common = dst_port in COMMON_PORTS
+    out[i, 7] = 1.0 if is_common else 0.0
+    out[i, 8] = 1.0 if dst_port in ATTACK_PORTS else 0.0
+    out[i, 9] = 0.0 if is_common else 1.0
+
+# Per-thread scratch row for the /predict hot path. The (1, 10) buffer and
+# its DataFrame wrapper (which views the buffer, copy=False) are allocated
+# once per worker thread and refilled in place on every request.
+_tls = threading.local()
+
+def _build_features_row(packet_bytes: int, protocol_index: int, entropy: float, dst_port: int) -> pd.DataFrame:
+    """Single-row counterpart of _build_features for the /predict hot path.
+
+    Fills a thread-local scratch row in place instead of allocating an
+    ndarray plus DataFrame per request. Column order matches _FEATURE_COLS.
+    The returned frame is overwritten by the thread's next call, so callers
+    must not retain it across requests.
+    """
+    buf = getattr(_tls, 'row_buf', None)
+    if buf is None:
+        buf = np.empty((1, len(_FEATURE_COLS)), dtype=np.float64)
+        _tls.row_buf = buf
+        _tls.row_df = pd.DataFrame(buf, columns=list(_FEATURE_COLS), copy=False)
+    _fill_feature_row(buf, 0, packet_bytes, protocol_index, entropy, dst_port)
+    return _tls.row_df
+
+def _parse_packet(data: dict) -> tuple:
+    """Extract and sanitize (bytes, protocol_index, entropy, dst_port) from a raw packet dict."""
+    packet_bytes = int(data.get('bytes', 0) or 0)
+    # Accept a precomputed integer protocol_index (e.g. from the worker or
+    # retrain path) before falling back to string normalization.
+    pi_raw = data.get('protocol_index')
+    if isinstance(pi_raw, int) and 0 <= pi_raw <= 3:
+        protocol_index = pi_raw
+    else:
+        protocol_index = _protocol_index(data.get('protocol'))
+
+    entropy_raw = data.get('entropy', None)
+    try:
+        entropy = float(entropy_raw) if entropy_raw is not None else 0.3
+    except Exception:
+        entropy = 0.3
+    entropy = max(0.0, min(1.0, entropy))
+
+    port_raw = data.get('dst_port', None)
+    if port_raw is None:
+        port_raw = data.get('port', None)
+    try:
+        dst_port = int(port_raw) if port_raw is not None else 80
+    except Exception:
+        dst_port = 80
+
+    return packet_bytes, protocol_index, entropy, dst_port
+
+# Opt-in (AI_PREDICT_CACHE=1) memo for repeated identical packets — flood
+# traffic replays the same (bytes, protocol, entropy, port) tuples over and
+# over. Keyed on the exact parsed features, so cached scores are
+# bit-identical to fresh ones; cleared whenever the model is (re)loaded.
+# Off by default: it only helps under repetitive traffic and predict()
+# already costs little when SHAP is disabled.
+_PREDICT_CACHE_ENABLED = (os.getenv('AI_PREDICT_CACHE', '0') or '0').strip() == '1'
+
+@functools.lru_cache(maxsize=4096)
+def _cached_raw_score(resolved: tuple, packet_bytes: int, protocol_index: int, entropy: float, dst_port: int) -> float:
+    est, cols, needs_reindex, _scaler = resolved
+    X = _build_features_row(packet_bytes, protocol_index, entropy, dst_port)
+    if needs_reindex:
+        X = X[list(cols)]
+    return float(est.decision_function(X)[0])
 
 def _reload_model_unsafe():
-    global _model, _model_error, _explainer
+    global _model, _model_error, _explainer, _resolved
+    _cached_raw_score.cache_clear()
     try:
         if not MODEL_PATH.exists():
             _model = None
+            _resolved = None
             _model_error = f"model file not found at {MODEL_PATH}"
             _explainer = None
         else:
-            _model = joblib.load(MODEL_PATH)
+            # Plain load: train_model.py now saves the bundle zlib-compressed,
+            # and joblib's mmap_mode misreads compressed archives (corrupted
+            # tree arrays on 1.4), so memory-mapping is off the table here.
+            bundle = joblib.load(MODEL_PATH)
+
+            # Resolve the per-model facts once instead of per predict call.
+            est = bundle.get('model') if isinstance(bundle, dict) else bundle
+            if isinstance(bundle, dict) and bundle.get('feature_columns'):
+                cols = tuple(bundle['feature_columns'])
+            else:
+                cols = _FEATURE_COLS
+            # Pipeline wraps scaler + model; scaler is None for a bare estimator.
+            scaler = est.steps[0][1] if est.__class__.__name__ == 'Pipeline' else None
+
+            _resolved = (est, cols, cols != _FEATURE_COLS, scaler)
+            _model = bundle
             _model_error = None
             try:
-                base_model = _model.get('model') if isinstance(_model, dict) else _model
-                if base_model.__class__.__name__ == 'Pipeline':
-                    # Pipeline wraps scaler + model; extract the estimator step at the end
-                    iforest_model = base_model.steps[-1][1]
-                    _explainer = shap.TreeExplainer(iforest_model)
-                else:
-                    _explainer = shap.TreeExplainer(base_model)
+                iforest_model = est.steps[-1][1] if scaler is not None else est
+                _explainer = shap.TreeExplainer(iforest_model)
             except Exception as e:
                 logger.error(f"Failed to initialize SHAP TreeExplainer: {e}")
                 _explainer = None
     except Exception as e:
         _model = None
+        _resolved = None
         _model_error = f"failed to load model from {MODEL_PATH}: {e}"
         _explainer = None
 
@@ -101,59 +243,60 @@ def reload_model() -> tuple[bool, str]:
             return False, _model_error
         return True, "Model reloaded successfully"
 
-def predict(data: dict) -> dict:
-    packet_id = data.get('id', None)
-    packet_bytes = int(data.get('bytes', 0) or 0)
-    protocol = data.get('protocol')
-    protocol_index = _protocol_index(protocol)
-    
-    entropy_raw = data.get('entropy', None)
-    try:
-        entropy = float(entropy_raw) if entropy_raw is not None else 0.3
-    except Exception:
-        entropy = 0.3
-    entropy = max(0.0, min(1.0, entropy))
-    
-    port_raw = data.get('dst_port', None)
-    if port_raw is None:
-        port_raw = data.get('port', None)
-    try:
-        dst_port = int(port_raw) if port_raw is not None else 80
-    except Exception:
-        dst_port = 80
-        
-    features = pd.DataFrame([{
-        'bytes': packet_bytes,
-        'protocol_index': protocol_index,
-        'entropy': entropy,
-        'dst_port': dst_port,
-    }])
+def _ensure_loaded_locked() -> tuple:
+    """Load (or retry loading) the model if needed.
+
+    Returns (model, error, explainer, resolved); resolved is the per-model
+    facts tuple, snapshotted here so callers never re-read the global and
+    race a failing reload that has already nulled it.
+
+    Fast path: once a model is resident, return it with a few plain global
+    reads — no lock acquisition per request. Reference assignment is atomic
+    under the GIL, and reload_model() swaps in fully-constructed objects, so
+    the worst case during a concurrent reload is pairing the new model with
+    the previous explainer for one request (the SHAP call is already guarded).
+    If the snapshot catches a reload mid-swap (resolved already cleared),
+    fall through to the locked path and read a consistent state there.
+
+    Retry loading if:
+    1. Never loaded yet (_model is None and _model_error is None), OR
+    2. Previously failed with "not found" but the file now exists (post-retrain recovery)
+    """
+    m = _model
+    if m is not None:
+        res = _resolved
+        if res is not None:
+            return m, None, _explainer, res
 
     with _model_lock:
-        # Retry loading if:
-        # 1. Never loaded yet (_model is None and _model_error is None), OR
-        # 2. Previously failed with "not found" but the file now exists (post-retrain recovery)
         should_load = _model is None and _model_error is None
         if not should_load and _model is None and _model_error and MODEL_PATH.exists():
             should_load = True  # model was retrained — clear stale error and reload
         if should_load:
             _reload_model_unsafe()
-            
-        m = _model
-        err = _model_error
-        explainer = _explainer
+
+        return _model, _model_error, _explainer, _resolved
+
+def predict(data: dict) -> dict:
+    packet_id = data.get('id', None)
+    packet_bytes, protocol_index, entropy, dst_port = _parse_packet(data)
+
+    m, err, explainer, resolved = _ensure_loaded_locked()
 
     if m is None:
         raise RuntimeError(f"Model not loaded: {err}")
+    est, cols, needs_reindex, scaler = resolved
 
-    X = _build_features(features)
-    if isinstance(m, dict):
-        pipeline = m.get('model')
-        cols = m.get('feature_columns') or list(X.columns)
-        raw_score = float(pipeline.decision_function(X[cols])[0])
-        X_eval = X[cols]
+    if _PREDICT_CACHE_ENABLED and explainer is None:
+        # Without SHAP the score is a pure function of the parsed features,
+        # so repeats are served from the LRU without touching sklearn.
+        raw_score = _cached_raw_score(resolved, packet_bytes, protocol_index, entropy, dst_port)
+        X_eval = None
     else:
-        raw_score = float(m.decision_function(X)[0])
+        X = _build_features_row(packet_bytes, protocol_index, entropy, dst_port)
+        if needs_reindex:
+            X = X[list(cols)]
+        raw_score = float(est.decision_function(X)[0])
         X_eval = X
 
     # Convert raw IsolationForest score to a 0-1 range
@@ -170,9 +313,7 @@ def predict(data: dict) -> dict:
     if explainer is not None:
         try:
             # If the model is a Pipeline, scale the features first
-            if isinstance(m, dict) and m.get('model').__class__.__name__ == 'Pipeline':
-                pipeline = m.get('model')
-                scaler = pipeline.steps[0][1]
+            if scaler is not None:
                 X_scaled = pd.DataFrame(
                     scaler.transform(X_eval),
                     columns=X_eval.columns,
@@ -222,3 +363,47 @@ def predict(data: dict) -> dict:
         "mitre": mitre,
         "id": packet_id,
     }
+
+def predict_batch(packets: list) -> list:
+    """
+    Score a batch of packets with a single decision_function call.
+
+    Amortizes sklearn's fixed per-call cost (input validation, tree-walk
+    setup) across the whole batch. SHAP explanations and MITRE tagging are
+    intentionally skipped — bulk callers only need scores; use predict()
+    when a full explanation is required.
+    """
+    if not packets:
+        return []
+
+    n = len(packets)
+    mat = np.empty((n, len(_FEATURE_COLS)), dtype=np.float64)
+    ids = []
+    for i, data in enumerate(packets):
+        ids.append(data.get('id', None))
+        packet_bytes, protocol_index, entropy, dst_port = _parse_packet(data)
+        _fill_feature_row(mat, i, packet_bytes, protocol_index, entropy, dst_port)
+
+    m, err, _, resolved = _ensure_loaded_locked()
+    if m is None:
+        raise RuntimeError(f"Model not loaded: {err}")
+    est, cols, needs_reindex, _scaler = resolved
+
+    X = pd.DataFrame(mat, columns=list(_FEATURE_COLS), copy=False)
+    if needs_reindex:
+        X = X[list(cols)]
+    raw_scores = est.decision_function(X)
+
+    # Same sigmoid mapping as predict(); vectorized over the batch.
+    with np.errstate(over='ignore'):
+        clamped = 1.0 / (1.0 + np.exp(-raw_scores * 5.0))
+
+    return [
+        {
+            "anomaly_score": float(clamped[i]),
+            "is_anomaly": bool(raw_scores[i] < 0),
+            "raw_score": float(raw_scores[i]),
+            "id": ids[i],
+        }
+        for i in range(n)
+    ]
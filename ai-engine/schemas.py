@@ -45,6 +45,27 @@ class PredictResponse(BaseModel):
     id: Optional[str] = None
 
 
+# ──────────────────────────────────────────────
+# /predict_batch
+# ──────────────────────────────────────────────
+
+class PredictBatchRequest(BaseModel):
+    """A batch of packets scored with a single model call."""
+    packets: list[PredictRequest] = Field(default_factory=list, description="Packets to score")
+
+
+class PredictBatchItem(BaseModel):
+    anomaly_score: float = Field(..., description="Clamped anomaly score (0.0 – 1.0)")
+    is_anomaly: bool
+    raw_score: float
+    id: Optional[str] = None
+
+
+class PredictBatchResponse(BaseModel):
+    count: int
+    results: list[PredictBatchItem]
+
+
 # ──────────────────────────────────────────────
 # /health
 # ──────────────────────────────────────────────
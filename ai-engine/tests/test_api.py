@@ -99,6 +99,39 @@ class TestPredictEndpoint:
         assert "error" in resp.json()
 
 
+class TestPredictBatchEndpoint:
+    @patch("app.predict_batch")
+    def test_batch_prediction(self, mock_batch, client):
+        mock_batch.return_value = [
+            {"anomaly_score": 0.2, "is_anomaly": False, "raw_score": 0.1, "id": "a"},
+            {"anomaly_score": 0.9, "is_anomaly": True, "raw_score": -0.2, "id": "b"},
+        ]
+
+        resp = client.post("/predict_batch", json={"packets": [
+            {"id": "a", "bytes": 100, "protocol": "TCP"},
+            {"id": "b", "bytes": 9000, "protocol": "UDP", "dst_port": 4444},
+        ]})
+
+        assert resp.status_code == 200
+        data = resp.json()
+        assert data["count"] == 2
+        assert data["results"][0]["id"] == "a"
+        assert data["results"][1]["is_anomaly"] is True
+
+    def test_empty_batch(self, client):
+        """An empty batch is valid and never touches the model."""
+        resp = client.post("/predict_batch", json={"packets": []})
+        assert resp.status_code == 200
+        assert resp.json()["count"] == 0
+
+    @patch("app.predict_batch")
+    def test_batch_error_returns_500(self, mock_batch, client):
+        mock_batch.side_effect = RuntimeError("Model not loaded: file not found")
+        resp = client.post("/predict_batch", json={"packets": [{"bytes": 100}]})
+        assert resp.status_code == 500
+        assert "error" in resp.json()
+
+
 class TestModelStatusEndpoint:
     def test_returns_model_status(self, client):
         resp = client.get("/admin/model-status")
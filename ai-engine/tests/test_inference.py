@@ -2,7 +2,7 @@ import os
 import threading
 import time
 import pytest
-from inference import predict, reload_model, _model_lock
+from inference import predict, predict_batch, reload_model, _model_lock
 
 from sklearn.ensemble import IsolationForest
 import pandas as pd
@@ -114,6 +114,24 @@ def test_predict_multithreaded_reload():
     assert len(exceptions) == 0, f"Exceptions occurred during concurrent access: {exceptions}"
 
 
+def test_predict_batch_matches_single():
+    packets = [
+        {"id": "p1", "bytes": 500, "protocol": "TCP", "dst_port": 80, "entropy": 0.4},
+        {"id": "p2", "bytes": 9999999, "protocol": "UDP", "dst_port": 4444, "entropy": 0.99},
+    ]
+    batch = predict_batch(packets)
+
+    assert len(batch) == 2
+    for pkt, res in zip(packets, batch):
+        single = predict(pkt)
+        assert res["id"] == pkt["id"]
+        assert res["raw_score"] == pytest.approx(single["raw_score"])
+        assert res["anomaly_score"] == pytest.approx(single["anomaly_score"])
+        assert res["is_anomaly"] == single["is_anomaly"]
+
+def test_predict_batch_empty():
+    assert predict_batch([]) == []
+
 def test_predict_shap_explanation():
     # A packet likely to be normal
     normal_data = {'bytes': 100, 'protocol': 'TCP', 'dst_port': 80}
@@ -148,4 +166,4 @@ def test_predict_shap_failure_graceful(monkeypatch):
     result = predict(anomaly_data)
     assert result.get('explanation') is None
     assert result.get('mitre') is None
-
+
@@ -1,222 +1,300 @@
-# ai-engine/train_model.py
-import pandas as pd
-import numpy as np
-from sklearn.ensemble import IsolationForest
-from sklearn.pipeline import Pipeline
-from sklearn.preprocessing import StandardScaler
-import joblib
-from pathlib import Path
-import math
-
-print("🧠 Training Tracel AI Model (v2 features + calibrated threshold)...")
-
-
-PROTOCOL_TO_INDEX = {
-    'TCP': 0,
-    'UDP': 1,
-    'ICMP': 2,
-    'HTTP': 3,
-}
-
-FEATURE_COLUMNS = ['bytes', 'protocol_index', 'entropy', 'dst_port']
-
-
-COMMON_PORTS = {80, 443, 8080}
-ATTACK_PORTS = {23, 53, 123, 445, 3389, 1900, 4444}
-
-
-def build_features(raw: pd.DataFrame) -> pd.DataFrame:
-    """Expand raw inputs into a more expressive feature set.
-
-    We still accept the base vector [bytes, protocol_index, entropy, dst_port],
-    but we create categorical/interaction-friendly columns so the model can learn
-    patterns like "high entropy + UDP" or "weird port" without relying purely on size.
-    """
-    df = raw.copy()
-
-    # Stabilize scales.
-    df['bytes_log'] = df['bytes'].astype(float).map(lambda x: math.log1p(max(0.0, x)))
-    df['entropy'] = df['entropy'].astype(float).clip(0.0, 1.0)
-    df['dst_port'] = df['dst_port'].astype(int)
-
-    # One-hot protocol.
-    df['proto_tcp'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['TCP']).astype(int)
-    df['proto_udp'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['UDP']).astype(int)
-    df['proto_icmp'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['ICMP']).astype(int)
-    df['proto_http'] = (df['protocol_index'] == PROTOCOL_TO_INDEX['HTTP']).astype(int)
-
-    # Port signals.
-    df['port_is_common'] = df['dst_port'].isin(COMMON_PORTS).astype(int)
-    df['port_is_attack'] = df['dst_port'].isin(ATTACK_PORTS).astype(int)
-    df['port_is_weird'] = (~df['dst_port'].isin(COMMON_PORTS)).astype(int)
-
-    cols = [
-        'bytes_log',
-        'entropy',
-        'dst_port',
-        'proto_tcp',
-        'proto_udp',
-        'proto_icmp',
-        'proto_http',
-        'port_is_common',
-        'port_is_attack',
-        'port_is_weird',
-    ]
-    return df[cols]
-
-# 1. GENERATE SYNTHETIC "NORMAL" TRAINING DATA
-# We ONLY show normal traffic so the model learns what "safe" looks like.
-# Features:
-#   [bytes, protocol_index, entropy, dst_port]
-# Normal profile:
-#   - protocol: mostly HTTP/TCP
-#   - entropy: low (structured payloads)
-#   - dst_port: 80/443/8080
-#   - bytes: ~150–950
-
-n = 6000
-
-normal_protocols = np.random.choice(
-    [PROTOCOL_TO_INDEX['HTTP'], PROTOCOL_TO_INDEX['TCP'], PROTOCOL_TO_INDEX['UDP'], PROTOCOL_TO_INDEX['ICMP']],
-    size=n,
-    p=[0.55, 0.35, 0.07, 0.03],
-)
-
-normal_entropy = np.random.uniform(0.1, 0.5, size=n)
-# Match the Node simulator: ports are chosen uniformly from [80, 443, 8080].
-normal_ports = np.random.choice([80, 443, 8080], size=n, p=[1/3, 1/3, 1/3])
-normal_bytes = np.random.randint(150, 951, size=n)
-
-df = pd.DataFrame({
-    'bytes': normal_bytes,
-    'protocol_index': normal_protocols,
-    'entropy': normal_entropy,
-    'dst_port': normal_ports,
-})
-
-# Expand into engineered features before training.
-X_train = build_features(df)
-
-# 2. TRAIN THE MODEL (Isolation Forest)
-# Use scaling so dst_port/bytes don't dominate entropy/protocol.
-# contamination controls the expected outlier proportion *in normal training data*;
-# set a small-but-not-tiny value to avoid the model being overly sensitive.
-model = Pipeline(
-    steps=[
-        ('scaler', StandardScaler()),
-        (
-            'iforest',
-            IsolationForest(
-                n_estimators=250,
-                # We will calibrate our own cutoff for a target false-positive rate,
-                # so keep contamination small and stable.
-                contamination=0.01,
-                random_state=42,
-                n_jobs=-1,
-            ),
-        ),
-    ]
-)
-model.fit(X_train)
-
-# 3. CALIBRATE THRESHOLD (balance FP on normal vs detection on attack-like)
-# IsolationForest decision_function: lower = more anomalous.
-# We calibrate a score cutoff using held-out synthetic NORMAL and ATTACK-like samples.
-# Goal:
-#   - Normal false positives: ~1–3%
-#   - Attack detection: typically 30–70% when simulator mixes traffic
-
-fp_target = 0.02
-fp_max = 0.025
-desired_attack_tpr = 0.45
-
-cal_n = 2500
-
-# Normal calibration samples (similar to training distribution)
-cal_normal = pd.DataFrame({
-    'bytes': np.random.randint(150, 951, cal_n),
-    'protocol_index': np.random.choice(
-        [PROTOCOL_TO_INDEX['HTTP'], PROTOCOL_TO_INDEX['TCP'], PROTOCOL_TO_INDEX['UDP'], PROTOCOL_TO_INDEX['ICMP']],
-        size=cal_n,
-        p=[0.55, 0.35, 0.07, 0.03],
-    ),
-    'entropy': np.random.uniform(0.1, 0.5, size=cal_n),
-    # Match the Node simulator: ports are chosen uniformly from [80, 443, 8080].
-    'dst_port': np.random.choice([80, 443, 8080], size=cal_n, p=[1/3, 1/3, 1/3]),
-})
-
-# Attack-like calibration samples (not used for fitting)
-# Key idea: high entropy + UDP/ICMP and/or attack ports, bytes can be small or large.
-cal_attack = pd.DataFrame({
-    'bytes': np.where(
-        np.random.rand(cal_n) < 0.55,
-        np.random.randint(80, 1201, cal_n),
-        np.random.randint(1000, 50001, cal_n),
-    ),
-    'protocol_index': np.random.choice(
-        [PROTOCOL_TO_INDEX['UDP'], PROTOCOL_TO_INDEX['ICMP'], PROTOCOL_TO_INDEX['TCP'], PROTOCOL_TO_INDEX['HTTP']],
-        size=cal_n,
-        p=[0.45, 0.25, 0.20, 0.10],
-    ),
-    'entropy': np.random.uniform(0.8, 1.0, size=cal_n),
-    'dst_port': np.where(
-        np.random.rand(cal_n) < 0.85,
-        np.random.choice(list(ATTACK_PORTS), size=cal_n),
-        np.random.randint(1, 65536, cal_n),
-    ),
-})
-
-scores_normal = model.decision_function(build_features(cal_normal))
-scores_attack = model.decision_function(build_features(cal_attack))
-
-# Start from a threshold that hits fp_target on normal.
-threshold = float(np.quantile(scores_normal, fp_target))
-
-def rate(scores, thr):
-    return float(np.mean(scores <= thr))
-
-fp = rate(scores_normal, threshold)
-tpr = rate(scores_attack, threshold)
-
-# If attack detection is too low, relax threshold upward but keep FP <= fp_max.
-# This helps keep attack(on) anomaly rates in the desired 30–70% range when the
-# simulator mixes malicious+normal traffic.
-if tpr < desired_attack_tpr:
-    # Candidate thresholds between fp_target..fp_max on normal.
-    cand = [float(np.quantile(scores_normal, q)) for q in np.linspace(fp_target, fp_max, 9)]
-    best = threshold
-    best_tpr = tpr
-    best_fp = fp
-    for thr in cand:
-        cand_fp = rate(scores_normal, thr)
-        cand_tpr = rate(scores_attack, thr)
-        if cand_fp <= fp_max and cand_tpr >= best_tpr:
-            best = thr
-            best_tpr = cand_tpr
-            best_fp = cand_fp
-    threshold = float(best)
-    fp = best_fp
-    tpr = best_tpr
-
-# 4. SAVE THE BRAIN
-# Save a small bundle so inference can use the calibrated cutoff.
-bundle = {
-    'version': 2,
-    'model': model,
-    'features': FEATURE_COLUMNS,
-    'feature_columns': list(X_train.columns),
-    'protocol_to_index': PROTOCOL_TO_INDEX,
-    'threshold': threshold,
-    'calibration': {
-        'fp_target': fp_target,
-        'fp_max': fp_max,
-        'fp_est': float(fp),
-        'attack_tpr_est': float(tpr),
-        'cal_n': int(cal_n),
-    },
-}
-
-out_path = Path(__file__).resolve().parent / 'model.pkl'
-joblib.dump(bundle, str(out_path))
-
+# ai-engine/train_model.py
+import pandas as pd
+import numpy as np
+from sklearn.ensemble import IsolationForest
+import joblib
+from threadpoolctl import threadpool_limits
+from pathlib import Path
+
+print("🧠 Training Tracel AI Model (v2 features + calibrated threshold)...")
+
+
+PROTOCOL_TO_INDEX = {
+    'TCP': 0,
+    'UDP': 1,
+    'ICMP': 2,
+    'HTTP': 3,
+}
+
+FEATURE_COLUMNS = ['bytes', 'protocol_index', 'entropy', 'dst_port']
+
+# Engineered-feature order produced by build_features; must match the
+# _FEATURE_COLS tuple in inference.py.
+ENGINEERED_COLUMNS = (
+    'bytes_log',
+    'entropy',
+    'dst_port',
+    'proto_tcp',
+    'proto_udp',
+    'proto_icmp',
+    'proto_http',
+    'port_is_common',
+    'port_is_attack',
+    'port_is_weird',
+)
+
+
+COMMON_PORTS = {80, 443, 8080}
+ATTACK_PORTS = {23, 53, 123, 445, 3389, 1900, 4444}
+
+# Sorted ndarray forms, built once at import: _port_member binary-searches
+# them, rng.choice avoids re-materializing a list from a set, and sorting
+# fixes the nondeterministic set iteration order.
+COMMON_PORTS_ARR = np.array(sorted(COMMON_PORTS), dtype=np.int32)
+ATTACK_PORTS_ARR = np.array(sorted(ATTACK_PORTS), dtype=np.int32)
+# One-hot column order for the proto_tcp..proto_http block of the matrix.
+PROTO_IDX_ARR = np.array(
+    [PROTOCOL_TO_INDEX[p] for p in ('TCP', 'UDP', 'ICMP', 'HTTP')], dtype=np.int64
+)
+
+
+def _port_member(sorted_ports: np.ndarray, ports: np.ndarray) -> np.ndarray:
+    """Membership of ports in a small sorted array via binary search.
+
+    For single-digit lookup tables searchsorted + equality beats np.isin's
+    generic hash/sort machinery: one vectorized binary search per element.
+    """
+    idx = np.searchsorted(sorted_ports, ports)
+    return (idx < sorted_ports.size) & (
+        sorted_ports[np.minimum(idx, sorted_ports.size - 1)] == ports
+    )
+
+
+def build_features_from_arrays(bytes_, proto_idx, entropy, dst_port) -> np.ndarray:
+    """Engineered features straight from column arrays — no pandas round-trip.
+
+    Fully vectorized: every feature is one NumPy pass over the input columns,
+    written into a single preallocated matrix — no per-row Python callbacks.
+    Returns the raw (n, 10) matrix in ENGINEERED_COLUMNS order.
+    """
+    b = np.asarray(bytes_, dtype=np.float64)
+    entropy = np.asarray(entropy, dtype=np.float64)
+    ports = np.asarray(dst_port, dtype=np.int64)
+    proto = np.asarray(proto_idx, dtype=np.int64)
+
+    # float32: sklearn's tree code works in single precision anyway, so this
+    # halves the matrix footprint instead of feeding float64 it would downcast.
+    mat = np.empty((b.size, 10), dtype=np.float32)
+    # Stabilize scales.
+    mat[:, 0] = np.log1p(np.maximum(b, 0.0))
+    mat[:, 1] = np.clip(entropy, 0.0, 1.0)
+    mat[:, 2] = ports
+    # One-hot protocol: one broadcasted comparison fills all four columns.
+    mat[:, 3:7] = proto[:, None] == PROTO_IDX_ARR
+    # Port signals; weird is the exact complement of common, so reuse it.
+    is_common = _port_member(COMMON_PORTS_ARR, ports)
+    mat[:, 7] = is_common
+    mat[:, 8] = _port_member(ATTACK_PORTS_ARR, ports)
+    mat[:, 9] = ~is_common
+
+    return mat
+
+
+def build_features(raw: pd.DataFrame) -> np.ndarray:
+    """Expand raw inputs into a more expressive feature set.
+
+    We still accept the base vector [bytes, protocol_index, entropy, dst_port],
+    but we create categorical/interaction-friendly columns so the model can learn
+    patterns like "high entropy + UDP" or "weird port" without relying purely on size.
+    """
+    return build_features_from_arrays(
+        raw['bytes'].to_numpy(),
+        raw['protocol_index'].to_numpy(),
+        raw['entropy'].to_numpy(),
+        raw['dst_port'].to_numpy(),
+    )
+
+
+def _named(mat: np.ndarray) -> pd.DataFrame:
+    """View an engineered matrix as a named frame for the sklearn boundary.
+
+    The estimator is fitted with feature names so inference (which scores
+    named single-row frames) stays warning-free; the wrap is copy=False, so
+    this costs one small object, not a matrix copy.
+    """
+    return pd.DataFrame(mat, columns=list(ENGINEERED_COLUMNS), copy=False)
+
+# 1. GENERATE SYNTHETIC "NORMAL" TRAINING DATA
+# We ONLY show normal traffic so the model learns what "safe" looks like.
+# Features:
+#   [bytes, protocol_index, entropy, dst_port]
+# Normal profile:
+#   - protocol: mostly HTTP/TCP
+#   - entropy: low (structured payloads)
+#   - dst_port: 80/443/8080
+#   - bytes: ~150–950
+
+n = 6000
+
+# One seeded PCG64 Generator for every draw in the script — faster than the
+# legacy global MT19937 and reproducible end to end, not just for the forest.
+rng = np.random.default_rng(42)
+
+normal_protocols = rng.choice(
+    [PROTOCOL_TO_INDEX['HTTP'], PROTOCOL_TO_INDEX['TCP'], PROTOCOL_TO_INDEX['UDP'], PROTOCOL_TO_INDEX['ICMP']],
+    size=n,
+    p=[0.55, 0.35, 0.07, 0.03],
+)
+
+normal_entropy = rng.uniform(0.1, 0.5, size=n)
+# Match the Node simulator: ports are chosen uniformly from [80, 443, 8080].
+normal_ports = rng.choice(COMMON_PORTS_ARR, size=n, p=[1/3, 1/3, 1/3])
+normal_bytes = rng.integers(150, 951, size=n)
+
+# Expand into engineered features before training — straight from the
+# generated arrays, no intermediate DataFrame.
+X_train = build_features_from_arrays(normal_bytes, normal_protocols, normal_entropy, normal_ports)
+
+# 2. TRAIN THE MODEL (Isolation Forest)
+# No scaler: isolation trees split at random thresholds between per-feature
+# min/max, so the algorithm is scale-invariant and standardizing the matrix
+# would only add a full copy+transform to every fit/decision_function call.
+# contamination controls the expected outlier proportion *in normal training data*;
+# set a small-but-not-tiny value to avoid the model being overly sensitive.
+model = IsolationForest(
+    n_estimators=250,
+    # Explicit rather than the 'auto' min(256, n) resolution;
+    # each tree sees at most 256 rows regardless of n.
+    max_samples=256,
+    # We will calibrate our own cutoff for a target false-positive rate,
+    # so keep contamination small and stable.
+    contamination=0.01,
+    random_state=42,
+    n_jobs=-1,
+)
+# Prophylactic cap: the Cython tree builders behind n_jobs=-1 use no
+# BLAS/OpenMP pools today, so this changes nothing on the current pins, but
+# it keeps a future sklearn/BLAS combination from oversubscribing cores
+# while the fit fans out over trees. threadpoolctl ships with scikit-learn,
+# so this adds no dependency.
+with threadpool_limits(limits=1):
+    model.fit(_named(X_train))
+
+# 3. CALIBRATE THRESHOLD (balance FP on normal vs detection on attack-like)
+# IsolationForest decision_function: lower = more anomalous.
+# We calibrate a score cutoff using held-out synthetic NORMAL and ATTACK-like samples.
+# Goal:
+#   - Normal false positives: ~1–3%
+#   - Attack detection: typically 30–70% when simulator mixes traffic
+
+fp_target = 0.02
+fp_max = 0.025
+desired_attack_tpr = 0.45
+
+cal_n = 2500
+
+# Normal calibration samples (similar to training distribution)
+cal_normal = build_features_from_arrays(
+    rng.integers(150, 951, cal_n),
+    rng.choice(
+        [PROTOCOL_TO_INDEX['HTTP'], PROTOCOL_TO_INDEX['TCP'], PROTOCOL_TO_INDEX['UDP'], PROTOCOL_TO_INDEX['ICMP']],
+        size=cal_n,
+        p=[0.55, 0.35, 0.07, 0.03],
+    ),
+    rng.uniform(0.1, 0.5, size=cal_n),
+    # Match the Node simulator: ports are chosen uniformly from [80, 443, 8080].
+    rng.choice(COMMON_PORTS_ARR, size=cal_n, p=[1/3, 1/3, 1/3]),
+)
+
+# Attack-like calibration samples (not used for fitting)
+# Key idea: high entropy + UDP/ICMP and/or attack ports, bytes can be small or large.
+# Draw each mixture branch only for the rows that picked it, instead of the
+# np.where pattern that generated both branches in full and threw half away.
+_small = rng.random(cal_n) < 0.55
+attack_bytes = np.empty(cal_n, dtype=np.int64)
+attack_bytes[_small] = rng.integers(80, 1201, int(_small.sum()))
+attack_bytes[~_small] = rng.integers(1000, 50001, int(cal_n - _small.sum()))
+
+_known_port = rng.random(cal_n) < 0.85
+attack_ports = np.empty(cal_n, dtype=np.int64)
+attack_ports[_known_port] = rng.choice(ATTACK_PORTS_ARR, size=int(_known_port.sum()))
+attack_ports[~_known_port] = rng.integers(1, 65536, int(cal_n - _known_port.sum()))
+
+cal_attack = build_features_from_arrays(
+    attack_bytes,
+    rng.choice(
+        [PROTOCOL_TO_INDEX['UDP'], PROTOCOL_TO_INDEX['ICMP'], PROTOCOL_TO_INDEX['TCP'], PROTOCOL_TO_INDEX['HTTP']],
+        size=cal_n,
+        p=[0.45, 0.25, 0.20, 0.10],
+    ),
+    rng.uniform(0.8, 1.0, size=cal_n),
+    attack_ports,
+)
+
+scores_normal = model.decision_function(_named(cal_normal))
+scores_attack = model.decision_function(_named(cal_attack))
+
+# Sort both score arrays once; every quantile below is then a direct
+# interpolated index instead of an O(n log n) np.quantile call, and every
+# rate() evaluation is a binary search instead of a full comparison pass.
+scores_normal_sorted = np.sort(scores_normal)
+scores_attack_sorted = np.sort(scores_attack)
+
+def quantile_fast(q):
+    """Linear-interpolated quantile of the pre-sorted normal scores."""
+    pos = q * (scores_normal_sorted.size - 1)
+    lo = int(pos)
+    hi = min(lo + 1, scores_normal_sorted.size - 1)
+    frac = pos - lo
+    return float(scores_normal_sorted[lo] * (1.0 - frac) + scores_normal_sorted[hi] * frac)
+
+# Start from a threshold that hits fp_target on normal.
+threshold = quantile_fast(fp_target)
+
+def rate(sorted_scores, thr):
+    """Fraction of scores <= thr, via binary search on a pre-sorted array."""
+    return float(np.searchsorted(sorted_scores, thr, side='right') / sorted_scores.size)
+
+fp = rate(scores_normal_sorted, threshold)
+tpr = rate(scores_attack_sorted, threshold)
+
+# If attack detection is too low, relax threshold upward but keep FP <= fp_max.
+# This helps keep attack(on) anomaly rates in the desired 30–70% range when the
+# simulator mixes malicious+normal traffic.
+if tpr < desired_attack_tpr:
+    # Candidate thresholds between fp_target..fp_max on normal, most relaxed
+    # first: rate() is monotone in the threshold, so the first candidate that
+    # meets both goals is the best one and the loop can stop there.
+    best = threshold
+    best_tpr = tpr
+    best_fp = fp
+    for q in np.linspace(fp_max, fp_target, 9):
+        thr = quantile_fast(q)
+        cand_fp = rate(scores_normal_sorted, thr)
+        cand_tpr = rate(scores_attack_sorted, thr)
+        if cand_fp <= fp_max and cand_tpr > best_tpr:
+            best = thr
+            best_tpr = cand_tpr
+            best_fp = cand_fp
+            if cand_tpr >= desired_attack_tpr:
+                break
+    threshold = float(best)
+    fp = best_fp
+    tpr = best_tpr
+
+# 4. SAVE THE BRAIN
+# Save a small bundle so inference can use the calibrated cutoff.
+bundle = {
+    'version': 2,
+    'model': model,
+    'features': FEATURE_COLUMNS,
+    'feature_columns': ENGINEERED_COLUMNS,
+    'protocol_to_index': PROTOCOL_TO_INDEX,
+    'threshold': threshold,
+    'calibration': {
+        'fp_target': fp_target,
+        'fp_max': fp_max,
+        'fp_est': float(fp),
+        'attack_tpr_est': float(tpr),
+        'cal_n': int(cal_n),
+    },
+}
+
+out_path = Path(__file__).resolve().parent / 'model.pkl'
+# zlib level 3 shrinks the tree arrays 3-5x for a cheap compression pass, and
+# pickle protocol 5 serializes the numpy buffers out-of-band. Compressed files
+# can't be memory-mapped at load, but decompression is faster than the extra
+# disk reads it replaces.
+joblib.dump(bundle, out_path, compress=3, protocol=5)
+
 print(f"✅ Model trained and saved as '{out_path}' (threshold={threshold:.6f})")
\ No newline at end of file